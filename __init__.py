@@ -1,10 +1,15 @@
-import sys, json
-from parse import parse
+import sys, json, functools
+from parse import parse as _parse
 from interpret import interpret
 
 
-def bedlam(script, **scope):
-    return interpret(parse(script), scope)
+# Parsed ASTs are never mutated by the interpreter (resolve works on a copy),
+# so it's safe to hand the same tree out for repeated scripts.
+parse = functools.lru_cache(maxsize=256)(_parse)
+
+
+def bedlam(script, *, numpy_reductions=False, **scope):
+    return interpret(parse(script), scope, numpy_reductions)
 
 
 if __name__ == '__main__':
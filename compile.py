@@ -0,0 +1,265 @@
+import sys
+from parse import (
+    parse,
+    TYPE_CALL, TYPE_VEC, TYPE_MAP, TYPE_STRING, TYPE_INT, TYPE_FLOAT,
+    TYPE_LOCAL, TYPE_UPVALUE, TYPE_GLOBAL, TYPE_BUILTIN, TYPE_CONST, TYPE_MAP_CONST, TYPE_CASE_CONST,
+)
+from resolve import resolve
+
+
+def compile_ast(nodes):
+    code, consts = [], []
+
+    for i, node in enumerate(nodes):
+        if i > 0:
+            code.append((OP_POP, None))
+
+        emit(node, code, consts)
+
+    if not nodes:
+        emit_const(None, code, consts)
+
+    code.append((OP_RET, None))
+
+    return code, consts
+
+
+def compile_node(node):
+    return compile_ast([node])
+
+
+# Opcodes
+
+
+(
+    OP_CONST,
+    OP_LOAD_LOCAL,
+    OP_LOAD_UPVALUE,
+    OP_LOAD_GLOBAL,
+    OP_STORE_LOCAL,
+    OP_VEC,
+    OP_MAP,
+    OP_CALL,
+    OP_CALL_BUILTIN,
+    OP_CALL_FORM,
+    OP_JUMP,
+    OP_JUMP_IF_FALSE,
+    OP_MATCH,
+    OP_SWITCH,
+    OP_COPY,
+    OP_POP,
+    OP_FAIL,
+    OP_EVAL,
+    OP_RET,
+) = range(19)
+
+
+# Emitters
+
+
+def emit(node, code, consts):
+    type = node['type']
+
+    if type in {TYPE_INT, TYPE_FLOAT, TYPE_STRING, TYPE_CONST}:
+        emit_const(node['value'], code, consts)
+    elif type == TYPE_LOCAL:
+        code.append((OP_LOAD_LOCAL, node['slot']))
+    elif type == TYPE_UPVALUE:
+        code.append((OP_LOAD_UPVALUE, (node['depth'], node['slot'])))
+    elif type == TYPE_GLOBAL:
+        code.append((OP_LOAD_GLOBAL, node))
+    elif type == TYPE_BUILTIN:
+        emit_const(node['ref'], code, consts)
+    elif type == TYPE_VEC:
+        for child in node['value']:
+            emit(child, code, consts)
+
+        code.append((OP_VEC, len(node['value'])))
+    elif type == TYPE_MAP:
+        for child in node['value']:
+            emit(child, code, consts)
+
+        code.append((OP_MAP, len(node['value'])))
+    elif type == TYPE_MAP_CONST:
+        emit_const(node['value'], code, consts)
+        code.append((OP_COPY, None))
+    elif type == TYPE_CALL and node['value']:
+        emit_call(node, code, consts)
+    elif type == TYPE_CASE_CONST:
+        emit_case_const(node, code, consts)
+    else:
+        # Anything we don't know how to compile is handed back to the tree-walker
+        code.append((OP_EVAL, node))
+
+
+def emit_const(value, code, consts):
+    code.append((OP_CONST, len(consts)))
+    consts.append(value)
+
+
+# Builtins that decide for themselves whether (and in what scope) to evaluate
+# their arguments, the rest are called with already evaluated ones
+SPECIAL_FORMS = {'defn', 'fn', 'let', 'if', 'when', 'case', 'or', 'and'}
+
+
+def emit_call(node, code, consts):
+    name, *args = node['value']
+    builtin = name['value'] if name['type'] == TYPE_BUILTIN else None
+    form = _forms.get(builtin)
+
+    if form is not None and form['accepts'](args):
+        form['emit'](args, node, code, consts)
+    elif builtin in SPECIAL_FORMS:
+        code.append((OP_CALL_FORM, (name['ref'], node, args)))
+    elif builtin is not None and callable(name['ref']):
+        # The callee is known statically, so it doesn't need to go on the stack
+        for arg in args:
+            emit(arg, code, consts)
+
+        code.append((OP_CALL_BUILTIN, (name['ref'], node, len(args))))
+    else:
+        # Anything bound under another name gets evaluated arguments; special
+        # forms reject those rather than evaluating them in the wrong place
+        emit(name, code, consts)
+
+        for arg in args:
+            emit(arg, code, consts)
+
+        code.append((OP_CALL, (node, len(args))))
+
+
+def placeholder(code):
+    code.append(None)
+
+    return len(code) - 1
+
+
+def patch(code, i, op, arg):
+    code[i] = (op, arg)
+
+
+# Special forms
+
+
+_forms = {}
+
+
+def define_form(name, accepts):
+    def wrap(f):
+        _forms[name] = {'emit': f, 'accepts': accepts}
+
+        return f
+
+    return wrap
+
+
+@define_form('if', lambda args: len(args) == 3)
+def emit_if(args, node, code, consts):
+    condition, yes, no = args
+
+    emit(condition, code, consts)
+    otherwise = placeholder(code)
+    emit(yes, code, consts)
+    end = placeholder(code)
+    patch(code, otherwise, OP_JUMP_IF_FALSE, len(code))
+    emit(no, code, consts)
+    patch(code, end, OP_JUMP, len(code))
+
+
+@define_form('when', lambda args: len(args) == 2)
+def emit_when(args, node, code, consts):
+    condition, yes = args
+
+    emit(condition, code, consts)
+    otherwise = placeholder(code)
+    emit(yes, code, consts)
+    end = placeholder(code)
+    patch(code, otherwise, OP_JUMP_IF_FALSE, len(code))
+    emit_const(None, code, consts)
+    patch(code, end, OP_JUMP, len(code))
+
+
+@define_form('case', lambda args: len(args) >= 2)
+def emit_case(args, node, code, consts):
+    value, *pairs = args
+    default = pairs.pop() if len(pairs) % 2 == 1 else None
+
+    emit(value, code, consts)
+
+    ends = []
+    for i in range(0, len(pairs), 2):
+        emit(pairs[i], code, consts)
+        miss = placeholder(code)
+        emit(pairs[i + 1], code, consts)
+        ends.append(placeholder(code))
+        patch(code, miss, OP_MATCH, len(code))
+
+    if default is None:
+        code.append((OP_FAIL, (node, "Case failed to match")))
+    else:
+        code.append((OP_POP, None))
+        emit(default, code, consts)
+
+    for end in ends:
+        patch(code, end, OP_JUMP, len(code))
+
+
+def is_binding(params):
+    pairs = params['value']
+
+    return (
+        params['type'] == TYPE_VEC
+        and len(pairs) % 2 == 0
+        and all(pair['type'] == TYPE_LOCAL for pair in pairs[0::2])
+    )
+
+
+@define_form('let', lambda args: len(args) == 2 and is_binding(args[0]))
+def emit_let(args, node, code, consts):
+    params, body = args
+    pairs = params['value']
+
+    for i in range(1, len(pairs), 2):
+        emit(pairs[i], code, consts)
+
+    for i in reversed(range(0, len(pairs), 2)):
+        code.append((OP_STORE_LOCAL, pairs[i]['slot']))
+
+    emit(body, code, consts)
+
+
+def emit_case_const(node, code, consts):
+    emit(node['value'], code, consts)
+    switch = placeholder(code)
+
+    ends, targets = [], {}
+    for key, branch in node['table'].items():
+        targets[key] = len(code)
+        emit(branch, code, consts)
+        ends.append(placeholder(code))
+
+    default = len(code)
+
+    if node['default'] is None:
+        code.append((OP_FAIL, (node, "Case failed to match")))
+    else:
+        emit(node['default'], code, consts)
+
+    patch(code, switch, OP_SWITCH, (targets, default))
+
+    for end in ends:
+        patch(code, end, OP_JUMP, len(code))
+
+
+# Main
+
+
+if __name__ == '__main__':
+    from interpret import _builtins
+
+    code, consts = compile_ast(resolve(parse(sys.argv[1]), _builtins)[0])
+
+    names = {v: k for k, v in globals().items() if k.startswith('OP_')}
+
+    for i, (op, arg) in enumerate(code):
+        print(i, names[op], arg if type(arg) == int else '')
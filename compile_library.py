@@ -0,0 +1,14 @@
+import pickle
+from parse import parse
+from interpret import read_library, LIBRARY_CACHE
+
+
+# Writes the parsed library next to its source, so interpret.py can skip
+# parsing it on import. Rerun whenever library.bedlam changes.
+
+
+if __name__ == '__main__':
+    source, digest = read_library()
+
+    with open(LIBRARY_CACHE, 'wb') as f:
+        pickle.dump({'digest': digest, 'ast': parse(source)}, f)
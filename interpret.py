@@ -1,26 +1,52 @@
-import json, sys, functools
-from parse import parse
-
-
-def interpret(ast, scope=None):
+import json, sys, os, hashlib, pickle
+from parse import (
+    parse, tag_types, AST_VERSION,
+    TYPE_CALL, TYPE_VEC, TYPE_MAP, TYPE_STRING, TYPE_INT, TYPE_FLOAT, TYPE_IDENTIFIER,
+    TYPE_LOCAL, TYPE_UPVALUE, TYPE_GLOBAL, TYPE_BUILTIN, TYPE_CONST, TYPE_MAP_CONST, TYPE_CASE_CONST,
+)
+
+from resolve import resolve
+from compile import (
+    compile_ast, compile_node,
+    OP_CONST, OP_LOAD_LOCAL, OP_LOAD_UPVALUE, OP_LOAD_GLOBAL, OP_STORE_LOCAL,
+    OP_VEC, OP_MAP, OP_CALL, OP_CALL_BUILTIN, OP_CALL_FORM, OP_JUMP, OP_JUMP_IF_FALSE, OP_MATCH, OP_SWITCH,
+    OP_COPY, OP_POP, OP_FAIL, OP_EVAL, OP_RET,
+)
+
+
+def interpret(ast, scope=None, numpy_reductions=False):
+    # With numpy_reductions, (reduce + init xs) and (reduce * init xs) over a
+    # vector of just ints or just floats run in numpy. Ints only go to numpy
+    # when the result is sure to fit in 64 bits, so the only difference from
+    # the plain loop is how float results get rounded. numpy is imported here
+    # rather than up front, since it takes longer to load than everything else.
+    if numpy_reductions:
+        global np
+
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("numpy_reductions requires numpy") from None
+
+    # Builtins and the library live in _base_scope, which global lookups fall
+    # back to, so scope only ever holds the caller's names and top-level defns
     scope = {} if scope is None else scope
-    scope.update(_builtins)
-    scope.update(_library)
+
+    ast, n_locals = resolve(ast, _builtins, numpy_reductions)
+    code, consts = compile_ast(ast)
 
     try:
-        result = evaluate_all(ast, {'scope': scope})
+        return run(code, consts, Frame([None] * n_locals, None, scope))
     except InterpreterReturn as exc:
         return exc.args[0]
 
-    return result[-1]
-
 
 # Utils
 
 
 def _get_root_context(context):
-    while 'parent' in context:
-        context = context['parent']
+    while context.parent is not None:
+        context = context.parent
 
     return context
 
@@ -40,11 +66,31 @@ def assert_arity(node, args, exact=None, min=None, max=None):
     return args
 
 
-def wrap(node, type, value):
-    new_node = node.copy()
-    new_node.update({'type': type, 'value': value})
+def assert_unevaluated(node, already_evaluated):
+    if already_evaluated:
+        raise InterpeterError("Special forms can't be applied to values", node)
 
-    return new_node
+
+def assert_called_by_name(node):
+    # The resolver only assigns slots for fn, defn and let where they're called
+    # by their own name, so they can't be bound to another name and called
+    if node['value'][0]['type'] != TYPE_BUILTIN:
+        raise InterpeterError("Special forms can't be called through another name", node)
+
+
+def call_fn(fn, args, node, context):
+    try:
+        return fn(args, node, context, already_evaluated=True)
+    except TypeError:
+        assert_callable(fn, fn, node)
+
+        raise
+
+
+def assert_callable(fn, name, node):
+    # Only checked once a call has failed, so the common path pays nothing
+    if not callable(fn):
+        raise InterpeterError(f"{name} is not a function", node) from None
 
 
 class InterpeterError(Exception):
@@ -59,23 +105,182 @@ class InterpreterReturn(Exception):
     pass
 
 
+class Frame:
+    __slots__ = ('locals', 'parent', 'globals')
+
+    def __init__(self, locals, parent, globals):
+        self.locals = locals
+        self.parent = parent
+        self.globals = globals
+
+
 def define_key(name, scope):
     def wrap(f):
-        scope[name] = f
+        scope[sys.intern(name)] = f
+
+        return f
+
+    return wrap
+
+
+def define_handler(type):
+    def wrap(f):
+        _handlers[type] = f
+
+        return f
 
     return wrap
 
 
+# Set by interpret() once numpy_reductions asks for it
+np = None
+
+INT64_MAX = 2 ** 63 - 1
+
+
+# Sum (fn_plus) or multiply (fn_multiply) r and xs in numpy, or return None if
+# that might not match the plain loop. Results come back as Python numbers.
+def reduce_numeric(fn, r, xs):
+    if type(xs) != list or not xs or type(r) not in {int, float}:
+        return None
+
+    types = set(map(type, xs))
+
+    if types == {float}:
+        xs = np.asarray(xs)
+
+        return r + float(xs.sum()) if fn is fn_plus else r * float(xs.prod())
+
+    if types != {int}:
+        return None
+
+    # Bound every partial result so int64 can't silently wrap around
+    m = max(max(xs), -min(xs))
+
+    if fn is fn_plus and m * len(xs) <= INT64_MAX:
+        return r + int(np.asarray(xs).sum())
+
+    if fn is fn_multiply and m.bit_length() * len(xs) < 63:
+        return r * int(np.asarray(xs).prod())
+
+    return None
+
+
+# Bytecode
+
+
+def run(code, consts, context):
+    frame = context.locals
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    ip = 0
+
+    # Opcodes are tested roughly in order of how often they execute
+    while True:
+        op, arg = code[ip]
+        ip += 1
+
+        if op == OP_LOAD_LOCAL:
+            push(frame[arg])
+        elif op == OP_CALL_BUILTIN:
+            fn, node, n = arg
+            if n:
+                args = stack[-n:]
+                del stack[-n:]
+            else:
+                args = []
+            push(fn(args, node, context, already_evaluated=True))
+        elif op == OP_CONST:
+            push(consts[arg])
+        elif op == OP_LOAD_GLOBAL:
+            push(handle_global(arg, context))
+        elif op == OP_CALL:
+            node, n = arg
+            if n:
+                args = stack[-n:]
+                del stack[-n:]
+            else:
+                args = []
+            fn = pop()
+
+            try:
+                push(fn(args, node, context, already_evaluated=True))
+            except TypeError:
+                assert_callable(fn, node['value'][0]['value'], node)
+
+                raise
+        elif op == OP_JUMP_IF_FALSE:
+            if not pop():
+                ip = arg
+        elif op == OP_RET:
+            return pop()
+        elif op == OP_JUMP:
+            ip = arg
+        elif op == OP_CALL_FORM:
+            fn, node, args = arg
+            push(fn(args, node, context))
+        elif op == OP_MATCH:
+            key = pop()
+
+            if key == stack[-1]:
+                pop()
+            else:
+                ip = arg
+        elif op == OP_SWITCH:
+            targets, default = arg
+
+            try:
+                ip = targets.get(pop(), default)
+            except TypeError:
+                ip = default
+        elif op == OP_LOAD_UPVALUE:
+            depth, slot = arg
+            parent = context
+            for _ in range(depth):
+                parent = parent.parent
+
+            push(parent.locals[slot])
+        elif op == OP_STORE_LOCAL:
+            frame[arg] = pop()
+        elif op == OP_VEC:
+            if arg:
+                stack[-arg:] = [stack[-arg:]]
+            else:
+                push([])
+        elif op == OP_MAP:
+            values = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            push({values[i]: values[i + 1] for i in range(0, arg, 2)})
+        elif op == OP_COPY:
+            stack[-1] = stack[-1].copy()
+        elif op == OP_POP:
+            pop()
+        elif op == OP_EVAL:
+            push(evaluate(arg, context))
+        elif op == OP_FAIL:
+            node, message = arg
+
+            raise InterpeterError(message, node)
+
+
+def compiled(node):
+    if 'code' not in node:
+        node['code'] = compile_node(node)
+
+    return node['code']
+
+
 # AST type handlers
 
 
 def evaluate(node, context):
-    handler = _handlers[node['type']]
-
-    return handler(node, context)
+    return _handlers[node['type']](node, context)
 
 
 def evaluate_all(nodes, context):
+    # Appending is faster than filling a preallocated [None] * n list by index,
+    # CPython over-allocates on append so there's very little copying
     result = []
     for node in nodes:
         result.append(evaluate(node, context))
@@ -83,60 +288,98 @@ def evaluate_all(nodes, context):
     return result
 
 
+def evaluate_args(args, context, already_evaluated):
+    return args if already_evaluated else evaluate_all(args, context)
+
+
+def evaluate_arg(arg, context, already_evaluated):
+    return arg if already_evaluated else evaluate(arg, context)
+
+
+def evaluate_pair(node, args, context, already_evaluated=False):
+    a, b = assert_arity(node, args, exact=2)
+
+    if already_evaluated:
+        return a, b
+
+    return evaluate(a, context), evaluate(b, context)
+
+
 _handlers = {}
 
 
-@define_key('call', _handlers)
+@define_handler(TYPE_CALL)
 def handle_call(node, context):
     name, *args = node['value']
 
     fn = evaluate(name, context)
 
-    if type(fn).__name__ != 'function':
-        raise InterpeterError(f"{name['value']} is not a function", node)
+    try:
+        return fn(args, node, context)
+    except TypeError:
+        assert_callable(fn, name['value'], node)
 
-    return fn(args, node, context)
+        raise
 
 
-@define_key('identifier', _handlers)
-def handle_identifier(node, context):
-    value = node['value']
+@define_handler(TYPE_LOCAL)
+def handle_local(node, context):
+    return context.locals[node['slot']]
 
-    while context:
-        if value in context['scope']:
-            return context['scope'][value]
 
-        context = context.get('parent')
+@define_handler(TYPE_UPVALUE)
+def handle_upvalue(node, context):
+    for _ in range(node['depth']):
+        context = context.parent
 
-    raise InterpeterError(f"Unable to resolve name {value}", node)
+    return context.locals[node['slot']]
 
 
-@define_key('any', _handlers)
-def handle_any(node, context):
-    return node['value']
+@define_handler(TYPE_BUILTIN)
+def handle_builtin(node, context):
+    return node['ref']
 
 
-@define_key('int', _handlers)
+@define_handler(TYPE_IDENTIFIER)
+@define_handler(TYPE_GLOBAL)
+def handle_global(node, context):
+    value = node['value']
+
+    if value in context.globals:
+        return context.globals[value]
+
+    if value in _base_scope:
+        return _base_scope[value]
+
+    raise InterpeterError(f"Unable to resolve name {value}", node)
+
+
+@define_handler(TYPE_INT)
 def handle_int(node, context):
     return node['value']
 
 
-@define_key('float', _handlers)
+@define_handler(TYPE_FLOAT)
 def handle_float(node, context):
     return node['value']
 
 
-@define_key('string', _handlers)
+@define_handler(TYPE_STRING)
 def handle_string(node, context):
     return node['value']
 
 
-@define_key('vec', _handlers)
+@define_handler(TYPE_CONST)
+def handle_const(node, context):
+    return node['value']
+
+
+@define_handler(TYPE_VEC)
 def handle_vec(node, context):
     return evaluate_all(node['value'], context)
 
 
-@define_key('map', _handlers)
+@define_handler(TYPE_MAP)
 def handle_map(node, context):
     value = node['value']
 
@@ -146,6 +389,31 @@ def handle_map(node, context):
     }
 
 
+@define_handler(TYPE_MAP_CONST)
+def handle_map_const(node, context):
+    return node['value'].copy()
+
+
+@define_handler(TYPE_CASE_CONST)
+def handle_case_const(node, context):
+    value = evaluate(node['value'], context)
+
+    try:
+        branch = node['table'].get(value, node['default'])
+    except TypeError:
+        branch = node['default']
+
+    if branch is None:
+        raise InterpeterError("Case failed to match", node)
+
+    return evaluate(branch, context)
+
+
+# Type tags are dense, so once every handler is defined a tuple indexed by tag
+# can stand in for the dict
+_handlers = tuple(_handlers[type] for type in range(len(_handlers)))
+
+
 # Builtins
 
 
@@ -153,109 +421,181 @@ _builtins = {'true': True, 'false': False, 'nil': None}
 
 
 @define_key('defn', _builtins)
-def fn_defn(args, node, context):
+def fn_defn(args, node, context, *, already_evaluated=False):
+    assert_unevaluated(node, already_evaluated)
+
     name, *args = assert_arity(node, args, min=3)
-    args = [wrap(node, 'identifier', 'fn')] + args
+    f = fn_fn(args, node, context)
 
-    context['scope'][name['value']] = evaluate(wrap(node, 'call', args), context)
+    if name['type'] == TYPE_LOCAL:
+        context.locals[name['slot']] = f
+    else:
+        context.globals[name['value']] = f
 
 
 @define_key('fn', _builtins)
-def fn_fn(args, node, context):
+def fn_fn(args, node, context, *, already_evaluated=False):
+    assert_unevaluated(node, already_evaluated)
+    assert_called_by_name(node)
+
     params, body = assert_arity(node, args, min=2)
+    params = params['value']
 
-    for param in params['value']:
-        if param['type'] != 'identifier':
+    for param in params:
+        if param['type'] != TYPE_LOCAL and param['value'] != '&':
             raise InterpeterError(f"Invalid function parameter {param['value']}", param)
 
-    def f(caller_args, caller_node, caller_context):
-        new_scope = {}
-        for i, param in enumerate(params['value']):
-            if param['value'] == '&':
-                rest = evaluate_all(caller_args[i:], caller_context)
-                new_scope[params['value'][i + 1]['value']] = rest
+    # Parameters occupy the first slots of the frame, the rest argument
+    # (if any) takes the slot right after the positional ones.
+    rest = next((i for i, param in enumerate(params) if param['value'] == '&'), None)
+    n_params = len(params) if rest is None else rest
 
-                break
+    if rest is not None and len(params) != rest + 2:
+        raise InterpeterError(f"Only one rest argument should be defined", node)
 
-            new_scope[param['value']] = evaluate(caller_args[i], caller_context)
+    factory = closure_factory(n_params, rest is not None, node['locals'])
 
-        if len(params['value']) > i + 2:
-            raise InterpeterError(f"Only one rest argument should be defined", node)
+    return factory(*compiled(body), context)
 
-        return evaluate(body, {'parent': context, 'scope': new_scope})
 
-    return f
+_closure_factories = {}
+
+
+# Generate (once per signature) a function that builds closures with the frame
+# construction unrolled, rather than looping over params on every call
+def closure_factory(n_params, has_rest, n_locals):
+    key = (n_params, has_rest, n_locals)
+
+    if key not in _closure_factories:
+        args = [f"caller_args[{i}]" for i in range(n_params)]
+        frame = [f"evaluate({arg}, caller_context)" for arg in args]
+
+        if has_rest:
+            args.append(f"list(caller_args[{n_params}:])")
+            frame.append(f"evaluate_all(caller_args[{n_params}:], caller_context)")
+
+        padding = ['None'] * (n_locals - len(frame))
+
+        source = (
+            "def factory(code, consts, context):\n"
+            "    globals = context.globals\n"
+            "    def f(caller_args, caller_node, caller_context, *, already_evaluated=False):\n"
+            "        if already_evaluated:\n"
+            f"            frame = [{', '.join(args + padding)}]\n"
+            "        else:\n"
+            f"            frame = [{', '.join(frame + padding)}]\n"
+            "        return run(code, consts, Frame(frame, context, globals))\n"
+            "    return f\n"
+        )
+
+        namespace = {'run': run, 'evaluate': evaluate, 'evaluate_all': evaluate_all, 'Frame': Frame}
+        exec(source, namespace)
+        _closure_factories[key] = namespace['factory']
+
+    return _closure_factories[key]
 
 
 @define_key('partial', _builtins)
-def fn_partial(args, node, context):
-    name, *args = assert_arity(node, args, min=2)
+def fn_partial(args, node, context, *, already_evaluated=False):
+    fn, *bound = evaluate_args(assert_arity(node, args, min=2), context, already_evaluated)
+
+    def f(caller_args, caller_node, caller_context, *, already_evaluated=False):
+        args = bound + evaluate_args(caller_args, caller_context, already_evaluated)
 
-    def f(caller_args, caller_node, caller_context):
-        return evaluate(wrap(node, 'call', [name] + args + caller_args), context)
+        return call_fn(fn, args, caller_node, caller_context)
 
     return f
 
 
 @define_key('apply', _builtins)
-def fn_apply(args, node, context):
-    f, args = assert_arity(node, args, exact=2)
-    args = [wrap(node, 'any', x) for x in evaluate(args, context)]
+def fn_apply(args, node, context, *, already_evaluated=False):
+    fn, xs = evaluate_args(assert_arity(node, args, exact=2), context, already_evaluated)
 
-    return evaluate(wrap(node, 'call', [f] + args), context)
+    return call_fn(fn, list(xs), node, context)
+
+
+# Variants are copies of a builtin with some flags set, for the resolver to
+# swap in where it knows they're safe (see resolve.use_variant). The lazy ones
+# return generators, for results that are only ever iterated once.
+def with_variant(name, **flags):
+    def wrap(f):
+        def variant(args, node, context, *, already_evaluated=False):
+            return f(args, node, context, already_evaluated=already_evaluated, **flags)
+
+        setattr(f, name, variant)
+
+        return f
+
+    return wrap
 
 
 @define_key('map', _builtins)
-def fn_map(args, node, context):
-    f, xs = assert_arity(node, args, exact=2)
-    xs = evaluate(xs, context)
+@with_variant('lazy', lazy=True)
+def fn_map(args, node, context, *, already_evaluated=False, lazy=False):
+    fn, xs = evaluate_args(assert_arity(node, args, exact=2), context, already_evaluated)
 
-    return [
-        evaluate(wrap(node, 'call', [f, wrap(node, 'any', x)]), context)
-        for x in xs
-    ]
+    if lazy:
+        return (call_fn(fn, [x], node, context) for x in xs)
+
+    return [call_fn(fn, [x], node, context) for x in xs]
 
 
 @define_key('filter', _builtins)
-def fn_filter(args, node, context):
-    f, xs = assert_arity(node, args, exact=2)
-    xs = evaluate(xs, context)
+@with_variant('lazy', lazy=True)
+def fn_filter(args, node, context, *, already_evaluated=False, lazy=False):
+    fn, xs = evaluate_args(assert_arity(node, args, exact=2), context, already_evaluated)
+
+    if lazy:
+        return (x for x in xs if call_fn(fn, [x], node, context))
 
-    return [
-        x for x in xs
-        if evaluate(wrap(node, 'call', [f, wrap(node, 'any', x)]), context)
-    ]
+    return [x for x in xs if call_fn(fn, [x], node, context)]
 
 
+# The numpy variant is used when interpret() is passed numpy_reductions
 @define_key('reduce', _builtins)
-def fn_reduce(args, node, context):
-    f, init, xs = assert_arity(node, args, exact=3)
+@with_variant('numpy', numpy=True)
+def fn_reduce(args, node, context, *, already_evaluated=False, numpy=False):
+    fn, r, xs = evaluate_args(assert_arity(node, args, exact=3), context, already_evaluated)
+
+    if numpy and (fn is fn_plus or fn is fn_multiply):
+        result = reduce_numeric(fn, r, xs)
+
+        if result is not None:
+            return result
 
-    r = evaluate(init, context)
-    for x in xs['value']:
-        r = evaluate(wrap(node, 'call', [f, x, wrap(node, init['type'], r)]), context)
+    for x in xs:
+        r = call_fn(fn, [x, r], node, context)
 
     return r
 
 
 @define_key('let', _builtins)
-def fn_let(args, node, context):
+def fn_let(args, node, context, *, already_evaluated=False):
+    assert_unevaluated(node, already_evaluated)
+    assert_called_by_name(node)
+
     params, body = assert_arity(node, args, min=2)
     pairs = params['value']
 
-    return evaluate(body, {
-        'parent': context,
-        'scope': {
-            pairs[i]['value']: evaluate(pairs[i + 1], context)
-            for i in range(0, len(pairs), 2)
-        },
-    })
+    for i in range(0, len(pairs), 2):
+        if pairs[i]['type'] != TYPE_LOCAL:
+            raise InterpeterError(f"Invalid binding {pairs[i]['value']}", pairs[i])
+
+    values = [evaluate(pairs[i + 1], context) for i in range(0, len(pairs), 2)]
+
+    for i, value in enumerate(values):
+        context.locals[pairs[i * 2]['slot']] = value
+
+    return evaluate(body, context)
 
 
 @define_key('if', _builtins)
-def fn_if(args, node, context):
+def fn_if(args, node, context, *, already_evaluated=False):
     condition, yes, no = assert_arity(node, args, exact=3)
 
+    if already_evaluated:
+        return yes if condition else no
+
     if evaluate(condition, context):
         return evaluate(yes, context)
 
@@ -263,77 +603,108 @@ def fn_if(args, node, context):
 
 
 @define_key('when', _builtins)
-def fn_when(args, node, context):
+def fn_when(args, node, context, *, already_evaluated=False):
     condition, yes = assert_arity(node, args, exact=2)
 
-    if evaluate(condition, context):
-        return evaluate(yes, context)
+    if evaluate_arg(condition, context, already_evaluated):
+        return evaluate_arg(yes, context, already_evaluated)
 
 
 @define_key('case', _builtins)
-def fn_case(args, node, context):
+def fn_case(args, node, context, *, already_evaluated=False):
     value_node, *pairs = assert_arity(node, args, min=2)
-    value = evaluate(value_node, context)
+    value = evaluate_arg(value_node, context, already_evaluated)
 
+    default = None
     if len(pairs) % 2 == 1:
         default = pairs[-1]
         pairs = pairs[:-1]
 
     for i in range(0, len(pairs), 2):
-        if evaluate(pairs[i], context) == value:
-            return evaluate(pairs[i + 1], context)
+        if evaluate_arg(pairs[i], context, already_evaluated) == value:
+            return evaluate_arg(pairs[i + 1], context, already_evaluated)
 
-    if default:
-        return evaluate(default, context)
+    if default is not None:
+        return evaluate_arg(default, context, already_evaluated)
 
     raise InterpeterError("Case failed to match", node)
 
 
 @define_key('exit', _builtins)
-def fn_exit(args, node, context):
-    assert_arity(node, args, exact=1)
+def fn_exit(args, node, context, *, already_evaluated=False):
+    [x] = assert_arity(node, args, exact=1)
 
-    raise InterpreterReturn(evaluate(args[0], context))
+    raise InterpreterReturn(evaluate_arg(x, context, already_evaluated))
 
 
 @define_key('join', _builtins)
-def fn_join(args, node, context):
-    sep, *args = assert_arity(node, args, min=1)
+def fn_join(args, node, context, *, already_evaluated=False):
+    sep, *xs = evaluate_args(assert_arity(node, args, min=1), context, already_evaluated)
 
-    return evaluate(sep, context).join([
-        str(evaluate(arg, context)) for arg in args
-    ])
+    return sep.join([str(x) for x in xs])
 
 
 @define_key('not', _builtins)
-def fn_not(args, node, context):
+def fn_not(args, node, context, *, already_evaluated=False):
     [x] = assert_arity(node, args, exact=1)
 
-    return not evaluate(x, context)
+    return not evaluate_arg(x, context, already_evaluated)
 
 
 @define_key('+', _builtins)
-def fn_plus(args, node, context):
-    return sum(evaluate_all(args, context))
+def fn_plus(args, node, context, *, already_evaluated=False):
+    # Binary addition is by far the most common, skip building a list for it.
+    # Starting from 0 keeps sum's semantics, so strings and vectors still fail.
+    if len(args) == 2:
+        if already_evaluated:
+            return 0 + args[0] + args[1]
+
+        return 0 + evaluate(args[0], context) + evaluate(args[1], context)
+
+    return sum(evaluate_args(args, context, already_evaluated))
 
 
 @define_key('-', _builtins)
-def fn_minus(args, node, context):
-    a, b = evaluate_all(assert_arity(node, args, exact=2), context)
+def fn_minus(args, node, context, *, already_evaluated=False):
+    a, b = evaluate_pair(node, args, context, already_evaluated)
 
     return a - b
 
 
+@define_key('inc', _builtins)
+def fn_inc(args, node, context, *, already_evaluated=False):
+    [x] = assert_arity(node, args, exact=1)
+
+    return evaluate_arg(x, context, already_evaluated) + 1
+
+
+@define_key('dec', _builtins)
+def fn_dec(args, node, context, *, already_evaluated=False):
+    [x] = assert_arity(node, args, exact=1)
+
+    return evaluate_arg(x, context, already_evaluated) - 1
+
+
 @define_key('*', _builtins)
-def fn_multiply(args, node, context):
-    xs = assert_arity(node, args, min=1)
+def fn_multiply(args, node, context, *, already_evaluated=False):
+    if len(args) == 2:
+        if already_evaluated:
+            return args[0] * args[1]
 
-    return functools.reduce(lambda r, x: r * evaluate(x, context), xs, 1)
+        return evaluate(args[0], context) * evaluate(args[1], context)
+
+    xs = evaluate_args(assert_arity(node, args, min=1), context, already_evaluated)
+
+    r = 1
+    for x in xs:
+        r *= x
+
+    return r
 
 
 @define_key('/', _builtins)
-def fn_divide(args, node, context):
-    a, b = evaluate_all(assert_arity(node, args, exact=2), context)
+def fn_divide(args, node, context, *, already_evaluated=False):
+    a, b = evaluate_pair(node, args, context, already_evaluated)
 
     if b == 0:
         raise InterpeterError("Division by zero", node)
@@ -342,39 +713,54 @@ def fn_divide(args, node, context):
 
 
 @define_key('>', _builtins)
-def fn_gt(args, node, context):
-    a, b = evaluate_all(assert_arity(node, args, exact=2), context)
+def fn_gt(args, node, context, *, already_evaluated=False):
+    a, b = evaluate_pair(node, args, context, already_evaluated)
 
     return a > b
 
 
 @define_key('<', _builtins)
-def fn_gt(args, node, context):
-    a, b = evaluate_all(assert_arity(node, args, exact=2), context)
+def fn_lt(args, node, context, *, already_evaluated=False):
+    a, b = evaluate_pair(node, args, context, already_evaluated)
 
     return a < b
 
 
 @define_key('=', _builtins)
-def fn_gt(args, node, context):
-    a, b = evaluate_all(assert_arity(node, args, exact=2), context)
+def fn_eq(args, node, context, *, already_evaluated=False):
+    a, b = evaluate_pair(node, args, context, already_evaluated)
 
     return a == b
 
 
 @define_key('or', _builtins)
-def fn_gt(args, node, context):
-    return any(evaluate_all(args, context))
+def fn_or(args, node, context, *, already_evaluated=False):
+    if already_evaluated:
+        return any(args)
+
+    # Stop at the first truthy argument, the rest are never evaluated
+    for arg in args:
+        if evaluate(arg, context):
+            return True
+
+    return False
 
 
 @define_key('and', _builtins)
-def fn_gt(args, node, context):
-    return all(evaluate_all(args, context))
+def fn_and(args, node, context, *, already_evaluated=False):
+    if already_evaluated:
+        return all(args)
+
+    for arg in args:
+        if not evaluate(arg, context):
+            return False
+
+    return True
 
 
 @define_key('nth', _builtins)
-def fn_nth(args, node, context):
-    xs, i = evaluate_all(assert_arity(node, args, exact=2), context)
+def fn_nth(args, node, context, *, already_evaluated=False):
+    xs, i = evaluate_pair(node, args, context, already_evaluated)
 
     if type(xs) != list:
         raise InterpeterError("Can't get index of non-vector", node)
@@ -383,8 +769,8 @@ def fn_nth(args, node, context):
 
 
 @define_key('slice', _builtins)
-def fn_slice(args, node, context):
-    xs, *slice_args = evaluate_all(assert_arity(node, args, min=2, max=4), context)
+def fn_slice(args, node, context, *, already_evaluated=False):
+    xs, *slice_args = evaluate_args(assert_arity(node, args, min=2, max=4), context, already_evaluated)
 
     if type(xs) != list:
         raise InterpeterError("Can't get slice of non-vector", node)
@@ -395,14 +781,50 @@ def fn_slice(args, node, context):
 # Library
 
 
+# Both files live next to this module. The cache in particular must never come
+# from the working directory, since unpickling it can run arbitrary code.
+LIBRARY_DIR = os.path.dirname(os.path.abspath(__file__))
+LIBRARY_SOURCE = os.path.join(LIBRARY_DIR, 'library.bedlam')
+LIBRARY_CACHE = os.path.join(LIBRARY_DIR, 'library.pickle')
+
+
+def read_library():
+    with open(LIBRARY_SOURCE, 'r') as f:
+        source = f.read()
+
+    # Cached ASTs are only valid for the node format they were written with
+    digest = hashlib.sha256(f'{AST_VERSION}:{source}'.encode()).hexdigest()
+
+    return source, digest
+
+
+def load_library_ast():
+    source, digest = read_library()
+
+    # The cache is written by compile_library.py, and keyed by the source's
+    # hash rather than mtime since git checkouts don't preserve mtimes
+    try:
+        with open(LIBRARY_CACHE, 'rb') as f:
+            cache = pickle.load(f)
+
+        if cache['digest'] == digest:
+            return cache['ast']
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError):
+        pass
+
+    return parse(source)
+
+
 _library = {}
+_base_scope = dict(_builtins)
+
+interpret(load_library_ast(), _library)
 
-with open('library.bedlam', 'r') as f:
-    interpret(parse(f.read()), _library)
+_base_scope.update(_library)
 
 
 # Main
 
 
 if __name__ == '__main__':
-    print(json.dumps(interpret(json.loads(sys.argv[1])), indent=2))
+    print(json.dumps(interpret(tag_types(json.loads(sys.argv[1]))), indent=2))
@@ -1,124 +1,204 @@
-import sys, json, re
+import sys, json
 
 
 def parse(s):
-    return build_ast(tokenize(s), {'line': 1, 'column': 0})
+    return build_ast(tokenize(s))
+
+
+# Node types
+
+
+# Nodes are tagged with small ints rather than names, so evaluators can
+# dispatch by indexing a tuple. The parser produces the first few, the rest
+# are introduced by the resolver.
+(
+    TYPE_CALL,
+    TYPE_VEC,
+    TYPE_MAP,
+    TYPE_STRING,
+    TYPE_INT,
+    TYPE_FLOAT,
+    TYPE_IDENTIFIER,
+    TYPE_LOCAL,
+    TYPE_UPVALUE,
+    TYPE_GLOBAL,
+    TYPE_BUILTIN,
+    TYPE_CONST,
+    TYPE_MAP_CONST,
+    TYPE_CASE_CONST,
+) = range(14)
+
+# Tag names by tag, for printing ASTs
+TYPE_NAMES = tuple(
+    name[len('TYPE_'):].lower()
+    for tag, name in sorted((tag, name) for name, tag in globals().items() if name.startswith('TYPE_'))
+)
+
+# Bump whenever the node format changes, cached ASTs are keyed on it
+AST_VERSION = 1
 
 
 # Tokenize
 
 
 def tokenize(s):
-    segments = map(pre_tokenize, enumerate(re.sub(r'\\"', QUOTE, s).split('"')))
-    tokens = re.split('[\s\n]+', '"'.join(segments).strip().replace(QUOTE, '"'))
+    line, line_start = 1, 0
+    i, n = 0, len(s)
 
-    return list(tokens)
+    while i < n:
+        c = s[i]
 
+        if c == '\n':
+            line += 1
+            line_start = i + 1
+            i += 1
+        elif c.isspace() or c == ',':
+            i += 1
+        elif c in BRACKETS:
+            yield c, line, i - line_start
 
-def pre_tokenize(x):
-    i, segment = x
+            i += 1
+        elif c == '"':
+            location = (line, i - line_start)
+            j = i + 1
 
-    # If we're in a string
-    if i % 2 == 1:
-        return segment.replace(' ', SPACE).replace('\n', NEWLINE)
+            while j < n and s[j] != '"':
+                if s[j] == '\\' and s[j + 1:j + 2] == '"':
+                    j += 1
+                elif s[j] == '\n':
+                    line += 1
+                    line_start = j + 1
 
-    segment = re.sub(r' ', f' {SPACE} ', segment)
-    segment = re.sub(r'\n', f' {NEWLINE} ', segment)
-    segment = re.sub(r'([\(\)\[\]\{\},])', r' \1 ', segment)
+                j += 1
 
-    return segment
+            if j == n:
+                raise ParserError("Syntax error: unterminated string", *location)
 
+            yield s[i:j + 1], *location
 
-def placeholder(name):
-    return f"__BEDLAM_{name}"
+            i = j + 1
+        else:
+            j = i + 1
+            while j < n and s[j] not in DELIMITERS and not s[j].isspace():
+                j += 1
 
+            yield s[i:j], line, i - line_start
 
-QUOTE = placeholder('QUOTE')
-SPACE = placeholder('SPACE')
-NEWLINE = placeholder('NEWLINE')
+            i = j
+
+
+# Any unicode whitespace separates tokens, and commas are treated as
+# whitespace too
+BRACKETS = frozenset('()[]{}')
+DELIMITERS = BRACKETS | {',', '"'}
 
 
 # Build AST
 
 
-class ParserError(Exception):
-    def __init__(self, message, location):
-        line = location['line']
-        column = location['column']
+OPENERS = {'(': TYPE_CALL, '[': TYPE_VEC, '{': TYPE_MAP}
+CLOSERS = frozenset(')]}')
+
+# Characters a number token can start with besides (unicode) digits, the
+# names float() accepts, and the common operators that can never be numbers
+NUMBER_START = frozenset('+-.')
+FLOAT_NAMES = frozenset(['inf', 'infinity', 'nan'])
+NOT_NUMBERS = frozenset(['+', '-', '.'])
+
 
+class ParserError(Exception):
+    def __init__(self, message, line, column):
         super(Exception, self).__init__(f"{message} (at line {line} column {column})")
 
 
-def build_ast(tokens, location, depth=0):
+def build_ast(tokens, opener=None):
+    # Nested calls share the iterator, each one consuming up to its closing bracket
+    tokens = iter(tokens)
     ast = []
 
-    def add_node(type, value, token):
-        ast.append({'type': type, 'value': value, 'location': location.copy()})
+    def add_node(type, value, line, column):
+        ast.append({'type': type, 'value': value, 'location': {'line': line, 'column': column}})
 
-        new_lines = len([x for x in token if x == '\n'])
+    for token, line, column in tokens:
+        type = OPENERS.get(token)
 
-        location['line'] += new_lines
-        location['column'] = 0 if new_lines else location['column'] + len(token)
+        if type is not None:
+            add_node(type, build_ast(tokens, (token, line, column)), line, column)
 
-    while tokens:
-        token, *tokens = tokens
+            continue
 
-        if token in {')', ']', '}'}:
-            if depth == 0:
-                raise ParserError(f"Syntax error: unexpected '{token}'", location)
+        if token in CLOSERS:
+            if opener is None:
+                raise ParserError(f"Syntax error: unexpected '{token}'", line, column)
 
-            return ast, tokens
+            return ast
 
-        if token == NEWLINE:
-            location['line'] += 1
-            location['column'] = 0
+        if token[0] == '"':
+            add_node(TYPE_STRING, token[1:-1].replace('\\"', '"'), line, column)
 
             continue
 
-        if token in {SPACE, ','}:
-            location['column'] += 1
+        # Only attempt number parsing for tokens that could be one, failed
+        # conversions are expensive
+        c = token[0]
 
-            continue
+        if (c.isdigit() or c in NUMBER_START or token.lower() in FLOAT_NAMES) and token not in NOT_NUMBERS:
+            try:
+                add_node(TYPE_INT, int(token), line, column)
 
-        if token in {'(', '[', '{'}:
-            if token == '(':
-                type = 'call'
+                continue
+            except ValueError:
+                pass
 
-            if token == '[':
-                type = 'vec'
+            try:
+                add_node(TYPE_FLOAT, float(token), line, column)
 
-            if token == '{':
-                type = 'map'
+                continue
+            except ValueError:
+                pass
 
-            children, tokens = build_ast(tokens, location, depth + 1)
+        # Names end up as dict keys in scopes, intern them so lookups can
+        # short-circuit on identity
+        add_node(TYPE_IDENTIFIER, sys.intern(token), line, column)
 
-            add_node(type, children, token)
+    if opener is not None:
+        token, line, column = opener
 
-            continue
+        raise ParserError(f"Syntax error: unclosed '{token}'", line, column)
 
-        if token[0] == '"':
-            add_node('string', token[1:-1].replace(SPACE, ' ').replace(NEWLINE, '\n'), token)
+    return ast
 
-            continue
 
-        try:
-            add_node('int', int(token), token)
+# Main
 
-            continue
-        except ValueError:
-            pass
 
-        try:
-            add_node('float', float(token), token)
+def name_types(x):
+    # Swap type tags for their names, so printed ASTs are readable
+    if isinstance(x, list):
+        return [name_types(item) for item in x]
 
-            continue
-        except ValueError:
-            pass
+    if isinstance(x, dict):
+        return {
+            k: TYPE_NAMES[v] if k == 'type' and 'location' in x else name_types(v)
+            for k, v in x.items()
+        }
 
-        add_node('identifier', token, token)
+    return x
 
-    return ast
+
+def tag_types(x):
+    # The reverse of name_types, for reading printed ASTs back in
+    if isinstance(x, list):
+        return [tag_types(item) for item in x]
+
+    if isinstance(x, dict):
+        return {
+            k: TYPE_NAMES.index(v) if k == 'type' and 'location' in x else tag_types(v)
+            for k, v in x.items()
+        }
+
+    return x
 
 
 if __name__ == '__main__':
-    print(json.dumps(parse(sys.argv[1]), indent=2))
+    print(json.dumps(name_types(parse(sys.argv[1])), indent=2))
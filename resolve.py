@@ -0,0 +1,281 @@
+import sys, json
+from parse import (
+    parse, name_types,
+    TYPE_CALL, TYPE_VEC, TYPE_MAP, TYPE_STRING, TYPE_INT, TYPE_FLOAT, TYPE_IDENTIFIER,
+    TYPE_LOCAL, TYPE_UPVALUE, TYPE_GLOBAL, TYPE_BUILTIN, TYPE_CONST, TYPE_CASE_CONST, TYPE_MAP_CONST,
+)
+
+
+def resolve(ast, builtins, numpy_reductions=False):
+    defined = set()
+    for node in ast:
+        collect_definitions(node, defined)
+
+    # Names that are redefined anywhere can't safely be bound to the builtin
+    builtins = {k: v for k, v in builtins.items() if k not in defined}
+    function = {'depth': 0, 'locals': 0}
+    scope = {
+        'names': {},
+        'parent': None,
+        'function': function,
+        'builtins': builtins,
+        'numpy_reductions': numpy_reductions,
+    }
+
+    return [resolve_node(node, scope) for node in ast], function['locals']
+
+
+# Utils
+
+
+def collect_definitions(node, defined):
+    if node['type'] not in {TYPE_CALL, TYPE_VEC, TYPE_MAP}:
+        return
+
+    value = node['value']
+
+    if node['type'] == TYPE_CALL and len(value) > 1 and value[0]['value'] == 'defn':
+        if value[1]['type'] == TYPE_IDENTIFIER:
+            defined.add(value[1]['value'])
+
+    for child in value:
+        collect_definitions(child, defined)
+
+
+def derive(node, **kw):
+    new_node = node.copy()
+    new_node.update(kw)
+
+    return new_node
+
+
+def child_scope(scope, function=None):
+    return {
+        'names': {},
+        'parent': scope,
+        'function': function or scope['function'],
+        'builtins': scope['builtins'],
+        'numpy_reductions': scope['numpy_reductions'],
+    }
+
+
+def bind(node, scope):
+    if node['type'] != TYPE_IDENTIFIER or node['value'] == '&':
+        return node
+
+    function = scope['function']
+    slot = function['locals']
+    function['locals'] += 1
+    scope['names'][node['value']] = slot
+
+    return derive(node, type=TYPE_LOCAL, slot=slot)
+
+
+def lookup(node, scope):
+    name = node['value']
+    depth = scope['function']['depth']
+
+    while scope:
+        if name in scope['names']:
+            slot = scope['names'][name]
+            distance = depth - scope['function']['depth']
+
+            if distance == 0:
+                return derive(node, type=TYPE_LOCAL, slot=slot)
+
+            return derive(node, type=TYPE_UPVALUE, depth=distance, slot=slot)
+
+        if scope['parent'] is None and name in scope['builtins']:
+            return derive(node, type=TYPE_BUILTIN, ref=scope['builtins'][name])
+
+        scope = scope['parent']
+
+    return derive(node, type=TYPE_GLOBAL)
+
+
+# Resolvers
+
+
+def resolve_node(node, scope):
+    type = node['type']
+
+    if type == TYPE_IDENTIFIER:
+        return lookup(node, scope)
+
+    if type == TYPE_VEC:
+        return derive(node, value=[resolve_node(child, scope) for child in node['value']])
+
+    if type == TYPE_MAP:
+        return fold_map(derive(node, value=[resolve_node(child, scope) for child in node['value']]))
+
+    if type == TYPE_CALL and node['value']:
+        return resolve_call(node, scope)
+
+    return derive(node)
+
+
+def resolve_call(node, scope):
+    name, *args = node['value']
+    name = resolve_node(name, scope)
+    form = name['value'] if name['type'] == TYPE_BUILTIN else None
+
+    if form == 'defn' and args:
+        target, *args = args
+
+        # Definitions at the top level go into the global scope
+        if scope['parent'] is not None:
+            target = bind(target, scope)
+        elif target['type'] == TYPE_IDENTIFIER:
+            target = derive(target, type=TYPE_GLOBAL)
+
+        return resolve_fn(derive(node, value=[name, target] + args), 2, scope)
+
+    if form == 'fn' and args:
+        return resolve_fn(derive(node, value=[name] + args), 1, scope)
+
+    if form == 'let' and args and args[0]['type'] == TYPE_VEC:
+        params, *body = args
+        pairs = params['value']
+        block = child_scope(scope)
+
+        values = [resolve_node(pair, scope) for pair in pairs[1::2]]
+        names = [bind(pair, block) for pair in pairs[0::2]]
+        pairs = [x for pair in zip(names, values) for x in pair] + names[len(values):]
+        body = [resolve_node(child, block) for child in body]
+
+        return derive(node, value=[name, derive(params, value=pairs)] + body)
+
+    node = derive(node, value=[name] + [resolve_node(arg, scope) for arg in args])
+
+    if form in LINEAR_CONSUMERS:
+        mark_lazy(node, LINEAR_CONSUMERS[form])
+
+    if form == 'reduce' and scope['numpy_reductions']:
+        node = use_variant(node, 'numpy')
+
+    if form == 'case':
+        return fold_case(node)
+
+    if form in PURE_BUILTINS:
+        return fold_call(node)
+
+    return node
+
+
+def resolve_fn(node, offset, scope):
+    value = node['value']
+    function = {'depth': scope['function']['depth'] + 1, 'locals': 0}
+    block = child_scope(scope, function)
+
+    head, rest = value[:offset], value[offset:]
+
+    if rest and rest[0]['type'] == TYPE_VEC:
+        params, *body = rest
+        rest = [derive(params, value=[bind(param, block) for param in params['value']])] + body
+
+    rest = [rest[0]] + [resolve_node(child, block) for child in rest[1:]] if rest else []
+
+    return derive(node, value=head + rest, locals=function['locals'])
+
+
+# Optimizations
+
+
+PURE_BUILTINS = {'+', '-', '*', '/', '>', '<', '=', 'inc', 'dec', 'not'}
+
+# Builtins for which (f a b c) == (f (f a b) c), so a literal prefix can be folded
+FOLDABLE_PREFIX = {'+', '*'}
+
+
+def is_literal(node):
+    # NaN never compares equal, so it can't be used as a lookup key
+    return node['type'] in {TYPE_INT, TYPE_FLOAT, TYPE_STRING, TYPE_CONST} and node['value'] == node['value']
+
+
+def literal(node, value):
+    # bool is a subclass of int, so look up the exact type
+    type = {int: TYPE_INT, float: TYPE_FLOAT, str: TYPE_STRING}.get(value.__class__, TYPE_CONST)
+
+    return derive(node, type=type, value=value)
+
+
+def fold_call(node):
+    name, *args = node['value']
+
+    n = 0
+    while n < len(args) and is_literal(args[n]):
+        n += 1
+
+    if n < len(args) and (n < 2 or name['value'] not in FOLDABLE_PREFIX):
+        return node
+
+    # Leave anything that fails (division by zero, bad types) to raise at runtime
+    try:
+        value = name['ref']([arg['value'] for arg in args[:n]], node, None, already_evaluated=True)
+    except Exception:
+        return node
+
+    if n == len(args):
+        return literal(node, value)
+
+    return derive(node, value=[name, literal(args[0], value)] + args[n:])
+
+
+def fold_case(node):
+    value, *pairs = node['value'][1:]
+    default = pairs.pop() if len(pairs) % 2 == 1 else None
+
+    if not pairs or not all(is_literal(key) for key in pairs[0::2]):
+        return node
+
+    # Keep the first branch for duplicate keys, like the linear scan would
+    table = {}
+    for i in range(0, len(pairs), 2):
+        table.setdefault(pairs[i]['value'], pairs[i + 1])
+
+    return derive(node, type=TYPE_CASE_CONST, value=value, table=table, default=default)
+
+
+# Builtins that iterate over one of their arguments exactly once, by index
+LINEAR_CONSUMERS = {'reduce': 3, 'apply': 2, 'map': 2, 'filter': 2}
+
+
+def use_variant(node, variant):
+    # Swap the builtin a call goes to for one of its variants (see
+    # interpret.with_variant), if it has that one
+    name, *args = node['value']
+
+    if name['type'] != TYPE_BUILTIN or not hasattr(name['ref'], variant):
+        return node
+
+    return derive(node, value=[derive(name, ref=getattr(name['ref'], variant))] + args)
+
+
+def mark_lazy(node, i):
+    # If the collection a linear consumer iterates over comes straight from a
+    # builtin with a lazy variant (map, filter), use that so no intermediate
+    # list gets built
+    value = node['value']
+
+    if len(value) > i and value[i]['type'] == TYPE_CALL and value[i]['value']:
+        value[i] = use_variant(value[i], 'lazy')
+
+
+def fold_map(node):
+    items = node['value']
+
+    if len(items) % 2 == 1 or not all(is_literal(item) for item in items):
+        return node
+
+    value = {items[i]['value']: items[i + 1]['value'] for i in range(0, len(items), 2)}
+
+    return derive(node, type=TYPE_MAP_CONST, value=value)
+
+
+# Main
+
+
+if __name__ == '__main__':
+    from interpret import _builtins
+
+    print(json.dumps(name_types(resolve(parse(sys.argv[1]), _builtins)[0]), indent=2, default=repr))